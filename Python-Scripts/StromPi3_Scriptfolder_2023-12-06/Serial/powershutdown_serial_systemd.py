@@ -1,14 +1,57 @@
 #!/usr/bin/env python
+"""
+Shut down the Raspberry Pi gracefully when the StromPi 3 announces a power
+failure on the serial interface.
+
+The StromPi 3 has to be set up with Raspberry Pi Shutdown and Powerfail
+Warning enabled and Serial-Less Mode disabled; its shutdown timer has to be
+longer than SHUTDOWN_TIMER below.
+
+
+Software installation
+=====================
+
+Copy this file to /usr/local/bin/powershutdown.py
+Copy ../strompi_logcfg.py to /usr/local/bin/strompi_logcfg.py
+$ sudo chmod +x /usr/local/bin/powershutdown.py
+Copy ../Serialless/powershutdown.service into /etc/systemd/system/powershutdown.service
+$ sudo chmod 664 /etc/systemd/system/powershutdown.service
+$ sudo systemctl daemon-reload
+$ sudo systemctl enable powershutdown.service
+$ sudo systemctl start powershutdown.service
+$ systemctl status powershutdown.service
+
+When run from the script folder, strompi_logcfg.py is found in the parent
+folder.
+"""
+
 import logging
-import logging.config
-import logging.handlers
 import os
+import re
+import select
 import signal
-from threading import Thread, Timer
-from time import sleep
+import sys
+import weakref
+from threading import Event, Lock, Thread
+from time import monotonic, sleep
 
 import serial
 
+try:
+    import strompi_logcfg
+except ImportError:
+    # Run from the script folder, strompi_logcfg.py is in the parent folder
+    sys.path.append(
+        os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)
+    )
+    try:
+        import strompi_logcfg
+    except ImportError:
+        sys.exit(
+            "strompi_logcfg.py not found: copy it from the StromPi3 script "
+            "folder next to this script, e.g. to /usr/local/bin"
+        )
+
 ##############################################################################
 # Here you have to set the SHUTDOWN_TIMER in seconds - it waits with the
 # shutdown of the Raspberry pi, in the case the primary voltage source turns
@@ -19,36 +62,56 @@ SHUTDOWN_TIMER = 10
 ##############################################################################
 
 LOGLEVEL = logging.DEBUG
-logcfg = {
-    "version": 1,
-    "formatters": {
-        "normal": {
-            "format": "%(asctime)-15s %(levelname)-8s %(module)-14s %(message)s"
-        },
-    },
-    "handlers": {
-        "console": {
-            "class": "logging.StreamHandler",
-            "formatter": "normal",
-            "level": LOGLEVEL,
-            "stream": "ext://sys.stdout",
-        },
-    },
-    "loggers": {"": {"handlers": ["console"], "level": LOGLEVEL}},
-}
-
-logging.config.dictConfig(logcfg)
+strompi_logcfg.setup(LOGLEVEL)
 logger = logging.getLogger(__name__)
 
+# Messages of the StromPi 3 and the power state they announce
+_POWER_MESSAGE = re.compile(rb"xxx(--StromPiPowerBack--|ShutdownRaspberryPi)xxx")
+POWER_MESSAGES = {b"--StromPiPowerBack--": True, b"ShutdownRaspberryPi": False}
+# The firmware sends its C strings including the terminating NUL, so every
+# message ends with b"\n\r\x00" and the line after it starts with b"\r\x00"
+_BLANKS = b" \t\r\n\x00"
+
+
+def power_state(line):
+    """Return the power state announced by the line, None if there is none."""
+    match = _POWER_MESSAGE.search(line)
+    return POWER_MESSAGES[match.group(1)] if match else None
+
+
+def _cleanup(ser):
+    """Close the serial port ser, if it is still open."""
+    try:
+        if ser.is_open:
+            ser.close()
+    except Exception as exc:
+        logger.warning(exc)
+
 
 class ShutdownSerial:
     """Watch the serial interface ser to signal power failure.
 
-    If a power failure is detected, a 'Timer' is started. When this timer
-    elapses, the system will be shut down, but if the power supply comes
-    back, the timer will be cancelled and nothing happens.
+    If a power failure is detected, a shutdown deadline is set. When this
+    deadline has passed, the system will be shut down, but if the power
+    supply comes back, the deadline will be cancelled and nothing happens.
+    A single shutdown thread waits for the deadline, so no new thread is
+    started for each power failure.
     """
 
+    __slots__ = (
+        "timeout",
+        "_deadline",
+        "_wake",
+        "_lock",
+        "ser",
+        "_buf",
+        "_poll",
+        "listener_thread",
+        "shutdown_thread",
+        "_finalizer",
+        "__weakref__",
+    )
+
     def __init__(self, timeout):
         """Initialize.
 
@@ -59,12 +122,24 @@ class ShutdownSerial:
             bounce: The bounce time (in ms).
         """
         self.timeout = timeout
-        self.timers = []
+        self._deadline = None
+        self._wake = Event()
+        self._lock = Lock()
         self.ser = serial.Serial()
+        self._buf = bytearray()
+        self._poll = select.poll()
         self.listener_thread = Thread(target=self.listen, daemon=True)
+        self.shutdown_thread = Thread(target=self.watch_deadline, daemon=True)
+        # Clean up behind us
+        self._finalizer = weakref.finalize(self, _cleanup, self.ser)
 
-    def __del__(self):
-        """Clean up behind us."""
+    def __enter__(self):
+        """Start watching the StromPi 3 when entering a 'with' block."""
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        """Stop watching the StromPi 3 when leaving a 'with' block."""
         self.stop()
 
     def start(self):
@@ -75,32 +150,67 @@ class ShutdownSerial:
         self.ser.stopbits = serial.STOPBITS_ONE
         self.ser.bytesize = serial.EIGHTBITS
         self.ser.timeout = 1
+        # Retry with exponential backoff and log every distinct error only once
+        delay = 0.1
+        last_error = None
         while not self.ser.is_open:
             try:
                 self.ser.open()
             except Exception as exc:
-                logger.warning(exc)
-            sleep(0.1)
+                if str(exc) != last_error:
+                    last_error = str(exc)
+                    logger.warning(exc)
+                sleep(delay)
+                delay = min(delay * 2, 5.0)
+        self._poll.register(self.ser.fileno(), select.POLLIN)
+        self.shutdown_thread.start()
         self.listener_thread.start()
         logger.info("Listening on %s", self.ser.port)
 
     def listen(self):
-        """Listening for incomming messages"""
+        """Listening for incomming messages
+
+        Everything that is waiting in the input buffer is read at once and
+        split into lines here, so a burst of messages is handled in one go.
+        poll() on the file descriptor wakes us up as soon as data arrived,
+        so there is no need to poll the input buffer.
+        """
         while self.ser.is_open:
-            if self.ser.inWaiting():
-                try:
-                    raw_msg = self.ser.readline()
-                    message = raw_msg.decode(encoding="UTF-8", errors="strict")
-                    if message and (not message.isspace()):
-                        logger.info(message)
-                    if message.find("xxx--StromPiPowerBack--xxx\n") != -1:
-                        self.power_change(power_on=True)
-                    elif message.find("xxxShutdownRaspberryPixxx\n") != -1:
-                        self.power_change(power_on=False)
-                except UnicodeDecodeError as exc:
-                    logger.warning(exc)
-                    logger.info(raw_msg)
-            sleep(0.1)
+            if not self._poll.poll(1000) or not self.ser.is_open:
+                # Timeout without any data or port closed meanwhile
+                continue
+            chunk = self.ser.read(self.ser.in_waiting or 1)
+            if not chunk:
+                # Timeout without any data
+                continue
+            self._buf += chunk
+            while b"\n" in self._buf:
+                raw_msg, _, self._buf = self._buf.partition(b"\n")
+                message = bytes(raw_msg.strip(_BLANKS))
+                if not message:
+                    continue
+                if logger.isEnabledFor(logging.INFO):
+                    logger.info("%s", message.decode("ascii", "replace"))
+                power_on = power_state(message)
+                if power_on is not None:
+                    self.power_change(power_on=power_on)
+
+    def watch_deadline(self):
+        """Shut down the system as soon as the pending deadline has passed."""
+        while True:
+            with self._lock:
+                deadline = self._deadline
+                remaining = None if deadline is None else deadline - monotonic()
+                expired = remaining is not None and remaining <= 0
+                if expired:
+                    self._deadline = None
+            if expired:
+                # Keep watching; if the shutdown failed, the next power
+                # failure tries again
+                self.shutdown()
+                continue
+            self._wake.wait(remaining)
+            self._wake.clear()
 
     def stop(self):
         """Stop watching the StromPi 3."""
@@ -117,24 +227,43 @@ class ShutdownSerial:
         """Callback function when the power supply changed."""
         if power_on:
             logger.info("Power back detected")
-            for timer in self.timers:
-                timer.cancel()
+            with self._lock:
+                self._deadline = None
+            self._wake.set()
         else:
             logger.info("Power failure detected")
-            timer = Timer(self.timeout, self.shutdown)
-            timer.start()
-            self.timers.append(timer)
+            with self._lock:
+                if self._deadline is not None:
+                    # Shutdown is already pending
+                    return
+                self._deadline = monotonic() + self.timeout
+            self._wake.set()
 
     def shutdown(self):
         """Safely shut down the system."""
         logger.info("Shutdown system")
-        os.system("sudo shutdown -h now")
+        command = ["/sbin/shutdown", "-h", "now"]
+        if os.geteuid() != 0:
+            # Started by hand as normal user, the service runs as root
+            command.insert(0, "sudo")
+        try:
+            # Unblock SIGTERM and SIGINT again, the child would inherit the
+            # signal mask of the service otherwise
+            pid = os.posix_spawnp(command[0], command, os.environ, setsigmask=())
+            _, status = os.waitpid(pid, 0)
+        except OSError as exc:
+            logger.error("Shutdown failed: %s", exc)
+            return
+        returncode = os.waitstatus_to_exitcode(status)
+        if returncode:
+            logger.error("Shutdown failed with exit code %d", returncode)
 
 
 if __name__ == "__main__":
-    s = ShutdownSerial(SHUTDOWN_TIMER)
-    signal.signal(signal.SIGTERM, s.signal)  # 'kill'
-    signal.signal(signal.SIGINT, s.signal)  # CTRL-C
-    s.start()
-    print("(CTRL-C for exit)")
-    signal.pause()
+    # 'kill' and CTRL-C; blocked before the watching threads are started,
+    # so that they are only received by the sigwait() below
+    sigs = {signal.SIGTERM, signal.SIGINT}
+    signal.pthread_sigmask(signal.SIG_BLOCK, sigs)
+    with ShutdownSerial(SHUTDOWN_TIMER) as s:
+        print("(CTRL-C for exit)")
+        s.signal(signal.sigwait(sigs), None)
@@ -1,5 +1,6 @@
 #!/usr/bin/env python
-import os
+import subprocess
+import time
 
 import serial
 
@@ -19,7 +20,7 @@ import serial
 WAIT_FOR_SHUTDOWNTIMER = 10
 ##############################################################################
 
-t = 0  # Temporary time-variable
+deadline = None  # Point in time (time.monotonic()) to shut down at
 
 ser = serial.Serial(
     port="/dev/serial0",
@@ -37,11 +38,18 @@ while 1:
         print(y)
     if y.find("xxx--StromPiPowerBack--xxx\n") != -1:
         print("PowerBack - Raspberry Pi Shutdown aborted")
-        t = 0
+        deadline = None
     elif y.find("xxxShutdownRaspberryPixxx\n") != -1:
         print("PowerFail - Raspberry Pi Shutdown")
-        t = WAIT_FOR_SHUTDOWNTIMER + 1
-    if t > 0:
-        t -= 1
-        if t == 1:
-            os.system("sudo shutdown -h now")
+        deadline = time.monotonic() + WAIT_FOR_SHUTDOWNTIMER
+    if deadline is not None and time.monotonic() >= deadline:
+        # Keep watching if the shutdown failed, the next power failure
+        # tries again
+        deadline = None
+        try:
+            result = subprocess.run(["sudo", "shutdown", "-h", "now"], check=False)
+        except OSError as exc:
+            print("Shutdown failed:", exc)
+        else:
+            if result.returncode:
+                print("Shutdown failed with exit code", result.returncode)
@@ -7,6 +7,8 @@ import os
 import serial
 GPIO.setmode(GPIO.BCM)
 GPIO_TPIN = 21
+# Written by powershutdown_serialless_systemd.py once Serialless Mode is enabled
+SERIALLESS_FLAG = '/run/strompi3-serialless.flag'
 
 
 GPIO.setup(GPIO_TPIN,GPIO.OUT)
@@ -18,4 +20,11 @@ print ("Setting GPIO to LOW to Disable Serialless Mode.")
 print ("This will take approx. 10 seconds.")
 time.sleep(10)
 GPIO.cleanup()
-print ("Serialless Mode is Disabled!")
\ No newline at end of file
+print ("Serialless Mode is Disabled!")
+# Make powershutdown_serialless_systemd.py enable Serialless Mode again
+if os.path.exists(SERIALLESS_FLAG):
+    try:
+        os.remove(SERIALLESS_FLAG)
+    except OSError as exc:
+        print ("Could not remove %s: %s" % (SERIALLESS_FLAG, exc))
+        print ("Remove it as root before restarting powershutdown.service.")
@@ -63,7 +63,10 @@ ExecStart=/usr/bin/python /usr/local/bin/powershutdown.py
 WantedBy=default.target
 --8<---
 
+Install gpiozero with the lgpio pin factory:
+$ sudo apt install python3-gpiozero python3-lgpio
 Copy this file to /usr/local/bin/powershutdown.py
+Copy ../strompi_logcfg.py to /usr/local/bin/strompi_logcfg.py
 $ sudo chmod +x /usr/local/bin/powershutdown.py
 Copy the above content into /etc/systemd/system/powershutdown.service
 $ sudo chmod 664 /etc/systemd/system/powershutdown.service
@@ -72,18 +75,40 @@ $ sudo systemctl enable powershutdown.service
 $ sudo systemctl start powershutdown.service
 $ systemctl status powershutdown.service
 
+When run from the script folder, strompi_logcfg.py is found in the parent
+folder.
 """
 
 import logging
-import logging.config
-import logging.handlers
 import os
 import signal
-from threading import Timer
-from time import sleep
+import sys
+import weakref
+from threading import Event, Lock, Thread
+from time import monotonic, sleep
 
-import RPi.GPIO as GPIO
 import serial
+from gpiozero import Button
+
+try:
+    import strompi_logcfg
+except ImportError:
+    # Run from the script folder, strompi_logcfg.py is in the parent folder
+    sys.path.append(
+        os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)
+    )
+    try:
+        import strompi_logcfg
+    except ImportError:
+        sys.exit(
+            "strompi_logcfg.py not found: copy it from the StromPi3 script "
+            "folder next to this script, e.g. to /usr/local/bin"
+        )
+
+# lgpio uses the GPIO character device, lets the kernel detect the edges
+# and works on all Raspberry Pi models including the Pi 5. gpiozero reads
+# this when the first device is created.
+os.environ.setdefault("GPIOZERO_PIN_FACTORY", "lgpio")
 
 # Here you can choose the connected GPIO-Pin (in BCM mode)
 # Pin 21 is the default pin when using the jumper on StromPi3 Rev1.1
@@ -92,63 +117,100 @@ GPIO_PIN = 21
 # How long (in seconds) can the power failure last before we shut down?
 SHUTDOWN_TIMER = 10
 
+# Marks that serialless mode was already enabled since the last boot.
+# The mode is stored in the flash of the StromPi 3, but it can be switched
+# off without a reboot by Stop_Serialless.py, which removes this flag again.
+# If the mode is disabled in any other way, remove the flag by hand before
+# restarting the service, otherwise the mode is not enabled again.
+SERIALLESS_FLAG = "/run/strompi3-serialless.flag"
+
 LOGLEVEL = logging.DEBUG
-logcfg = {
-    "version": 1,
-    "formatters": {
-        "normal": {
-            "format": "%(asctime)-15s %(levelname)-8s %(module)-14s %(message)s"
-        },
-    },
-    "handlers": {
-        "console": {
-            "class": "logging.StreamHandler",
-            "formatter": "normal",
-            "level": LOGLEVEL,
-            "stream": "ext://sys.stdout",
-        },
-    },
-    "loggers": {"": {"handlers": ["console"], "level": LOGLEVEL}},
-}
-
-logging.config.dictConfig(logcfg)
+strompi_logcfg.setup(LOGLEVEL)
 logger = logging.getLogger(__name__)
 
 
+def _cleanup(button):
+    """Remove the callbacks of button and release its pin."""
+    try:
+        button.when_pressed = None
+        button.when_released = None
+        button.close()
+    except Exception as exc:
+        logger.warning(exc)
+
+
 class ShutdownSerialless:
     """Watch the pin used by StromPi 3 to signal power failure.
 
-    If a power failure is detected, a 'Timer' is started. When this timer
-    elapses, the system will be shut down, but if the power supply comes
-    back, the timer will be cancelled and nothing happens.
+    If a power failure is detected, a shutdown deadline is set. When this
+    deadline has passed, the system will be shut down, but if the power
+    supply comes back, the deadline will be cancelled and nothing happens.
+    A single shutdown thread waits for the deadline, so no new thread is
+    started for each power failure.
     """
 
-    def __init__(self, pin, timeout, mode=GPIO.BCM, bounce=300):
+    __slots__ = (
+        "pin",
+        "timeout",
+        "bounce",
+        "button",
+        "_deadline",
+        "_wake",
+        "_lock",
+        "shutdown_thread",
+        "_finalizer",
+        "__weakref__",
+    )
+
+    def __init__(self, pin, timeout, bounce=300):
         """Initialize.
 
         Parameters:
-            pin: The pin where the StromPi 3 announces the power failure.
+            pin: The pin (in BCM mode) where the StromPi 3 announces the
+                power failure.
             timeout: How long to wait before initiating a system shutdown.
-            mode: The GPIO mode how the pins are named.
             bounce: The bounce time (in ms).
         """
         self.pin = pin
         self.timeout = timeout
-        self.mode = mode
         self.bounce = bounce
-        self.timers = []
-
-    def __del__(self):
-        """Clean up behind us."""
+        self.button = None
+        self._deadline = None
+        self._wake = Event()
+        self._lock = Lock()
+        self.shutdown_thread = Thread(target=self.watch_deadline, daemon=True)
+        self._finalizer = None
+
+    def __enter__(self):
+        """Start watching the StromPi 3 when entering a 'with' block."""
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        """Stop watching the StromPi 3 when leaving a 'with' block."""
         self.stop()
 
     def start(self):
         """Start watching the StromPi 3."""
         # Start Serialless Mode
-        GPIO.setmode(GPIO.BCM)
-        GPIO_TPIN = 21
+        if os.path.exists(SERIALLESS_FLAG):
+            logger.info("Serialless already enabled")
+        else:
+            self.enable_serialless()
+        self.shutdown_thread.start()
+        # Initialization; the pin is pulled low on power failure
+        self.button = Button(self.pin, pull_up=True, bounce_time=self.bounce / 1000)
+        # Add interrupt handling routine
+        self.button.when_pressed = self.power_change
+        self.button.when_released = self.power_change
+        # Clean up behind us in stop(), at the latest at interpreter exit.
+        # The callbacks reference this instance, so it is not collected
+        # before _cleanup() has removed them.
+        self._finalizer = weakref.finalize(self, _cleanup, self.button)
+        logger.info("Safe shutdown in the case of power failure enabled")
 
-        breakS = 0.1
+    def enable_serialless(self):
+        """Switch the StromPi 3 into serialless mode via the serial console."""
         breakL = 0.2
         serial_port = serial.Serial()
         serial_port.baudrate = 38400
@@ -158,67 +220,97 @@ class ShutdownSerialless:
         serial_port.stopbits = 1
         serial_port.parity = serial.PARITY_NONE
 
-        if serial_port.isOpen():
+        if serial_port.is_open:
             serial_port.close()
         serial_port.open()
 
-        serial_port.write(str.encode("quit"))
-        sleep(breakS)
-        serial_port.write(str.encode("\x0D"))
-        sleep(breakL)
-        serial_port.write(str.encode("set-config 0 2"))
-        sleep(breakS)
-        serial_port.write(str.encode("\x0D"))
-        sleep(breakL)
+        # The StromPi 3 reads one character at a time and does not answer
+        # these commands, so give it some time to process each of them.
+        for command in (b"quit\r", b"set-config 0 2\r"):
+            serial_port.write(command)
+            serial_port.flush()
+            sleep(breakL)
+        serial_port.close()
         logger.info("Enabled Serialless")
-        # Initialization
-        GPIO.setmode(self.mode)
-        GPIO.setup(self.pin, GPIO.IN, pull_up_down=GPIO.PUD_UP)
-        # Add interrupt handling routine
-        GPIO.add_event_detect(
-            self.pin, GPIO.BOTH, callback=self.power_change, bouncetime=self.bounce
-        )
-        logger.info("Safe shutdown in the case of power failure enabled")
+        try:
+            open(SERIALLESS_FLAG, "w").close()
+        except OSError as exc:
+            logger.warning(exc)
+
+    def watch_deadline(self):
+        """Shut down the system as soon as the pending deadline has passed."""
+        while True:
+            with self._lock:
+                deadline = self._deadline
+                remaining = None if deadline is None else deadline - monotonic()
+                expired = remaining is not None and remaining <= 0
+                if expired:
+                    self._deadline = None
+            if expired:
+                # Keep watching; if the shutdown failed, the next power
+                # failure tries again
+                self.shutdown()
+                continue
+            self._wake.wait(remaining)
+            self._wake.clear()
 
     def stop(self):
         """Stop watching the StromPi 3."""
-        if GPIO.getmode() is not None:
+        if self.button is not None:
             # Remove interrupt handling routine and clean up behind us
-            GPIO.remove_event_detect(self.pin)
-            GPIO.cleanup()
+            self._finalizer()
+            self.button = None
 
     def signal(self, sig, frame):
         """Handle the signal 'sig'."""
         self.stop()
         if sig == signal.SIGINT:
-            # We got a keyboard interrupt, print a new line
-            logger.info()
+            logger.info("Keyboard interrupt by CTRL-C")
         logger.info("Safe shutdown in the case of power failure disabled")
 
-    def power_change(self, pin):
+    def power_change(self, button):
         """Callback function when the power supply changed."""
-        if GPIO.input(self.pin):
+        if not button.is_pressed:
             # If pin is high, we are back on the power supply
             logger.info("Power back detected")
-            for t in self.timers:
-                t.cancel()
+            with self._lock:
+                self._deadline = None
+            self._wake.set()
         else:
             # If pin is low, we lost the power supply
             logger.info("Power failure detected")
-            t = Timer(self.timeout, self.shutdown)
-            t.start()
-            self.timers.append(t)
+            with self._lock:
+                if self._deadline is not None:
+                    # Shutdown is already pending
+                    return
+                self._deadline = monotonic() + self.timeout
+            self._wake.set()
 
     def shutdown(self):
         """Safely shut down the system."""
         logger.info("Shutdown system")
-        os.system("sudo shutdown -h now")
+        command = ["/sbin/shutdown", "-h", "now"]
+        if os.geteuid() != 0:
+            # Started by hand as normal user, the service runs as root
+            command.insert(0, "sudo")
+        try:
+            # Unblock SIGTERM and SIGINT again, the child would inherit the
+            # signal mask of the service otherwise
+            pid = os.posix_spawnp(command[0], command, os.environ, setsigmask=())
+            _, status = os.waitpid(pid, 0)
+        except OSError as exc:
+            logger.error("Shutdown failed: %s", exc)
+            return
+        returncode = os.waitstatus_to_exitcode(status)
+        if returncode:
+            logger.error("Shutdown failed with exit code %d", returncode)
 
 
 if __name__ == "__main__":
-    s = ShutdownSerialless(GPIO_PIN, SHUTDOWN_TIMER)
-    signal.signal(signal.SIGTERM, s.signal)  # 'kill'
-    signal.signal(signal.SIGINT, s.signal)  # CTRL-C
-    s.start()
-    print("(CTRL-C for exit)")
-    signal.pause()
+    # 'kill' and CTRL-C; blocked before the watching threads are started,
+    # so that they are only received by the sigwait() below
+    sigs = {signal.SIGTERM, signal.SIGINT}
+    signal.pthread_sigmask(signal.SIG_BLOCK, sigs)
+    with ShutdownSerialless(GPIO_PIN, SHUTDOWN_TIMER) as s:
+        print("(CTRL-C for exit)")
+        s.signal(signal.sigwait(sigs), None)
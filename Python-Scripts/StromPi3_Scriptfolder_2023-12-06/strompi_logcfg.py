@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+"""
+Common logging configuration of the StromPi 3 shutdown scripts.
+
+Used by Serial/powershutdown_serial_systemd.py and
+Serialless/powershutdown_serialless_systemd.py. They find this file in the
+parent folder when they are run from the script folder. When installed,
+copy it next to the script, e.g. to /usr/local/bin/strompi_logcfg.py.
+"""
+
+import atexit
+import logging
+import logging.handlers
+import queue
+import signal
+import sys
+
+FORMAT = "%(asctime)-15s %(levelname)-8s %(module)-14s %(message)s"
+
+_listener = None
+
+
+class LocalQueueHandler(logging.handlers.QueueHandler):
+    """Put log records into the queue without formatting them.
+
+    The default prepare() formats the message in the calling thread, which
+    is only needed if the record leaves the process. Here, all formatting
+    happens in the thread of the QueueListener.
+    """
+
+    def prepare(self, record):
+        """Return the record unchanged."""
+        return record
+
+
+def setup(level=logging.DEBUG):
+    """Log to stdout and return the QueueListener serving the output.
+
+    Log records are only put into a queue by the logging threads, the
+    output is written by the thread of the returned listener. It is started
+    here and stopped at exit, which writes out the records still queued.
+    Further calls return the same listener.
+    """
+    global _listener
+    if _listener is not None:
+        return _listener
+    # Thread and process information is not part of the log format
+    logging.logThreads = False
+    logging.logProcesses = False
+    logging.logMultiprocessing = False
+    logging.basicConfig(level=level, format=FORMAT, stream=sys.stdout)
+    root_logger = logging.getLogger()
+    log_queue = queue.Queue()
+    _listener = logging.handlers.QueueListener(
+        log_queue, *root_logger.handlers, respect_handler_level=True
+    )
+    root_logger.handlers = [LocalQueueHandler(log_queue)]
+    # The shutdown scripts wait for SIGTERM and SIGINT with sigwait() in the
+    # main thread, so they are blocked in the listener thread
+    mask = signal.pthread_sigmask(signal.SIG_BLOCK, {signal.SIGTERM, signal.SIGINT})
+    _listener.start()
+    signal.pthread_sigmask(signal.SIG_SETMASK, mask)
+    atexit.register(_listener.stop)
+    return _listener